@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark the related-memories index on a synthetic archive.
+
+Builds an index over N entries drawn from a Zipf-distributed vocabulary,
+then reports build time, memory footprint and per-query latency, both
+right after a build and with a populated delta segment.
+
+Run from the backend directory:
+    python -m benchmarks.related_memories_bench [--entries 50000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from services.related import RelatedMemoriesIndex
+
+def synthetic_entries(count: int, vocabulary: int, mean_words: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    words = np.array([f"word{i}" for i in range(vocabulary)])
+    ranks = np.arange(1, vocabulary + 1)
+    probabilities = (1 / ranks) / (1 / ranks).sum()
+    lengths = rng.poisson(mean_words, size=count) + 5
+    for i, length in enumerate(lengths):
+        yield {
+            "_id": f"entry-{i}",
+            "prompt": f"prompt about {words[rng.integers(vocabulary)]}",
+            "content": " ".join(rng.choice(words, size=length, p=probabilities)),
+        }
+
+def time_queries(index: RelatedMemoriesIndex, entry_ids, k: int):
+    timings = []
+    for entry_id in entry_ids:
+        start = time.perf_counter()
+        index.related(entry_id, k)
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.percentile(timings, [50, 95, 99])
+
+def main(count: int, vocabulary: int, mean_words: int, queries: int, updates: int, k: int):
+    index = RelatedMemoriesIndex()
+    entries = list(synthetic_entries(count, vocabulary, mean_words))
+
+    start = time.perf_counter()
+    index.build(entries)
+    build_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(1)
+    sample = [f"entry-{i}" for i in rng.integers(count, size=queries)]
+
+    print(f"entries={len(index)} terms={len(index.vocabulary)} postings={len(index.post_rows)}")
+    print(f"build: {build_seconds:.2f}s  footprint: {index.nbytes / 2**20:.1f} MiB")
+    p50, p95, p99 = time_queries(index, sample, k)
+    print(f"related (compacted):  p50={p50:.2f}ms p95={p95:.2f}ms p99={p99:.2f}ms")
+
+    start = time.perf_counter()
+    for entry in synthetic_entries(updates, vocabulary, mean_words, seed=2):
+        entry["_id"] = f"new-{entry['_id']}"
+        index.upsert(entry)
+    upsert_ms = (time.perf_counter() - start) * 1000 / updates
+    print(f"upsert: {upsert_ms:.3f}ms each, delta rows={len(index.delta)}")
+    p50, p95, p99 = time_queries(index, sample, k)
+    print(f"related (with delta): p50={p50:.2f}ms p95={p95:.2f}ms p99={p99:.2f}ms")
+    print(f"footprint after updates: {index.nbytes / 2**20:.1f} MiB")
+
+    # Only the snapshot and install steps run on the event loop; build_postings runs in an executor
+    start = time.perf_counter()
+    snapshot = index.compaction_snapshot()
+    snapshot_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    postings = index.build_postings(*snapshot[2:])
+    build_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    index.install(snapshot, postings)
+    install_ms = (time.perf_counter() - start) * 1000
+    print(f"compaction: build_postings {build_ms:.0f}ms off-loop, snapshot {snapshot_ms:.1f}ms + install {install_ms:.1f}ms on-loop")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=50000)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--mean-words", type=int, default=80)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+    main(args.entries, args.vocabulary, args.mean_words, args.queries, args.updates, args.k)
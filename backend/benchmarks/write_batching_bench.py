@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Throughput versus latency of entry inserts with and without group commit.
+
+Runs closed-loop clients that each insert memory-sized documents one at a
+time, first with plain insert_one and then through InsertBatcher for a grid
+of window/batch-size settings, and prints docs/s with p50/p95 latency.
+
+Against MongoDB (MONGO_URL from backend/.env, scratch database):
+    python -m benchmarks.write_batching_bench --clients 200
+Without a server, using a latency model of the round trip and server cost:
+    python -m benchmarks.write_batching_bench --simulated-rtt-ms 1.0
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+from models.memory import MemoryEntry
+from services.write_batcher import InsertBatcher
+
+class SimulatedCollection:
+    """Round trip over a bounded connection pool plus serialized server work per command and per document"""
+
+    def __init__(self, rtt_ms: float, command_ms: float, document_ms: float, pool_size: int):
+        self.rtt = rtt_ms / 1000
+        self.command = command_ms / 1000
+        self.document = document_ms / 1000
+        self.pool = asyncio.Semaphore(pool_size)
+        self.server = asyncio.Lock()
+        self.next_id = 0
+
+    async def _command(self, documents):
+        async with self.pool:
+            await asyncio.sleep(self.rtt / 2)
+            async with self.server:
+                await asyncio.sleep(self.command + self.document * len(documents))
+            await asyncio.sleep(self.rtt / 2)
+        for document in documents:
+            document.setdefault("_id", self.next_id)
+            self.next_id += 1
+
+    async def insert_one(self, document):
+        await self._command([document])
+
+    async def insert_many(self, documents, ordered=True):
+        await self._command(documents)
+
+    async def drop(self):
+        pass
+
+def make_document():
+    return MemoryEntry(
+        family_id="bench",
+        prompt="Tell me about your children when they were little.",
+        content="word " * 150,
+        category="Family",
+        word_count=150
+    ).dict()
+
+async def run(collection, clients: int, inserts_per_client: int, batcher=None):
+    latencies = []
+
+    async def client():
+        for _ in range(inserts_per_client):
+            document = make_document()
+            start = time.perf_counter()
+            if batcher is None:
+                await collection.insert_one(document)
+            else:
+                await batcher.insert(document)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return len(latencies) / elapsed, p50, p95
+
+async def main(args):
+    if args.simulated_rtt_ms is not None:
+        collection = SimulatedCollection(args.simulated_rtt_ms, args.command_ms, args.document_ms, args.pool_size)
+        client = None
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        load_dotenv(Path(__file__).parent.parent / '.env')
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'], maxPoolSize=args.pool_size)
+        collection = client["memory_keeper_write_bench"].memory_entries
+
+    print(f"{'mode':<24}{'docs/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    throughput, p50, p95 = await run(collection, args.clients, args.inserts)
+    print(f"{'insert_one':<24}{throughput:>10.0f}{p50:>10.2f}{p95:>10.2f}")
+
+    for window_ms in args.windows:
+        for max_batch in args.batch_sizes:
+            batcher = InsertBatcher(collection, window_ms=window_ms, max_batch=max_batch)
+            throughput, p50, p95 = await run(collection, args.clients, args.inserts, batcher)
+            await batcher.drain()
+            label = f"window={window_ms}ms max={max_batch}"
+            print(f"{label:<24}{throughput:>10.0f}{p50:>10.2f}{p95:>10.2f}")
+
+    await collection.drop()
+    if client is not None:
+        client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200, help="Concurrent closed-loop writers")
+    parser.add_argument("--inserts", type=int, default=20, help="Inserts per writer")
+    parser.add_argument("--pool-size", type=int, default=100, help="Connection pool size (motor default is 100)")
+    parser.add_argument("--windows", type=float, nargs="+", default=[1, 2, 5, 10])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--simulated-rtt-ms", type=float, default=None, help="Use the latency model instead of MongoDB")
+    parser.add_argument("--command-ms", type=float, default=0.15, help="Model: serialized server cost per command")
+    parser.add_argument("--document-ms", type=float, default=0.01, help="Model: serialized server cost per document")
+    asyncio.run(main(parser.parse_args()))
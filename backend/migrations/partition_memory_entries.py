@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Tag memory entries that predate multi-tenant partitioning with a family_id,
+then create the tenant-scoped compound indexes.
+
+Run from the backend directory:
+    python -m migrations.partition_memory_entries [--family-id default] [--shard]
+"""
+
+import argparse
+import asyncio
+import logging
+
+from models.memory import DEFAULT_FAMILY_ID
+from routes.memory import SHARD_KEY, client, db, ensure_indexes, get_collection
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def tag_untagged_entries(family_id: str) -> int:
+    """Assign family_id to every entry that does not have one yet"""
+    result = await get_collection().update_many(
+        {"family_id": {"$exists": False}},
+        {"$set": {"family_id": family_id}}
+    )
+    return result.modified_count
+
+async def shard_collection():
+    """Enable sharding on the database and shard memory_entries by SHARD_KEY"""
+    await client.admin.command("enableSharding", db.name)
+    await client.admin.command(
+        "shardCollection",
+        f"{db.name}.{get_collection().name}",
+        key=SHARD_KEY
+    )
+
+async def main(family_id: str, shard: bool):
+    tagged = await tag_untagged_entries(family_id)
+    logger.info(f"Tagged {tagged} untagged entries with family_id={family_id!r}")
+
+    await ensure_indexes()
+    logger.info("Tenant-scoped indexes are in place")
+
+    if shard:
+        await shard_collection()
+        logger.info(f"Sharded memory_entries on {SHARD_KEY}")
+
+    client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--family-id", default=DEFAULT_FAMILY_ID, help="Family to assign untagged entries to")
+    parser.add_argument("--shard", action="store_true", help="Also shard the collection (requires mongos)")
+    args = parser.parse_args()
+    asyncio.run(main(args.family_id, args.shard))
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Rebuild the pre-aggregated timeline rollups from the raw memory entries.
+
+Rollups are kept up to date on every write; run this offline to backfill
+them for existing data or to repair drift after a failed rollup write.
+
+Run from the backend directory:
+    python -m migrations.rebuild_timeline [--family-id FAMILY]
+"""
+
+import argparse
+import asyncio
+import logging
+
+from routes.memory import client, ensure_indexes, get_collection, get_timeline_collection
+from services import timeline
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def main(family_id):
+    await ensure_indexes()
+    buckets = await timeline.rebuild(get_collection(), get_timeline_collection(), family_id)
+    scope = f"family_id={family_id!r}" if family_id else "all families"
+    logger.info(f"Rebuilt {buckets} timeline buckets for {scope}")
+    client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--family-id", default=None, help="Only rebuild this family's rollups")
+    args = parser.parse_args()
+    asyncio.run(main(args.family_id))
@@ -1,8 +1,16 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
+from enum import Enum
 import uuid
 
+# Partition key used when a request does not name a family
+DEFAULT_FAMILY_ID = "default"
+
+class Tenant(BaseModel):
+    family_id: str = DEFAULT_FAMILY_ID
+    user_id: Optional[str] = None
+
 class MemoryPrompt(BaseModel):
     id: int
     category: str
@@ -10,6 +18,8 @@ class MemoryPrompt(BaseModel):
 
 class MemoryEntry(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    family_id: str = DEFAULT_FAMILY_ID  # Partition/shard key, every query is scoped by it
+    user_id: Optional[str] = None  # Family member who wrote the entry
     prompt: str
     content: str
     date: datetime = Field(default_factory=datetime.utcnow)
@@ -30,6 +40,8 @@ class MemoryEntryCreate(BaseModel):
 
 class MemoryEntryResponse(BaseModel):
     id: str
+    family_id: str = DEFAULT_FAMILY_ID
+    user_id: Optional[str] = None
     prompt: str
     content: str
     date: datetime
@@ -40,9 +52,35 @@ class MemoryEntryResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class MemoryEvent(BaseModel):
+    type: str  # "created", "updated" or "deleted"
+    entry_id: str
+    entry: Optional[MemoryEntryResponse] = None  # Absent for deletions
+
+class RelatedMemory(BaseModel):
+    entry: MemoryEntryResponse
+    score: float  # Cosine similarity of the TF-IDF vectors, 0..1
+
 class MemoryStats(BaseModel):
+    family_id: str = DEFAULT_FAMILY_ID
     total_entries: int
     total_words: int
     average_words: int
     categories: dict
-    recent_entries: List[MemoryEntryResponse]
\ No newline at end of file
+    recent_entries: List[MemoryEntryResponse]
+
+class TimelineGranularity(str, Enum):
+    day = "day"
+    week = "week"
+    month = "month"
+
+class TimelineBucket(BaseModel):
+    bucket_start: datetime
+    entries: int = 0
+    words: int = 0
+    categories: Dict[str, Dict[str, int]] = Field(default_factory=dict)  # category -> {"entries", "words"}
+
+class MemoryTimeline(BaseModel):
+    family_id: str = DEFAULT_FAMILY_ID
+    granularity: TimelineGranularity
+    buckets: List[TimelineBucket]
\ No newline at end of file
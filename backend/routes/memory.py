@@ -1,15 +1,34 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument
+from pymongo.errors import OperationFailure
 from bson import ObjectId
 from datetime import datetime
+import asyncio
 import logging
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from pathlib import Path
 
-from models.memory import MemoryEntry, MemoryEntryCreate, MemoryEntryResponse, MemoryPrompt, MemoryStats
+from models.memory import (
+    DEFAULT_FAMILY_ID,
+    MemoryEntry,
+    MemoryEntryCreate,
+    MemoryEntryResponse,
+    MemoryPrompt,
+    MemoryStats,
+    MemoryTimeline,
+    RelatedMemory,
+    Tenant,
+    TimelineGranularity,
+)
+from services import timeline
+from services.events import EventBroker, entry_event, feed_from_change_stream
+from services.related import RelatedMemoriesRegistry, recommend_prompts
+from services.write_batcher import InsertBatcher
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -48,9 +67,121 @@ MEMORY_PROMPTS = [
     {"id": 18, "category": "Traditions", "prompt": "What family traditions did you celebrate growing up?"}
 ]
 
+# Every query is scoped by family_id, so all indexes lead with it. The API
+# identifies entries by str(_id), so the shard key is {family_id, _id}: single
+# entry reads and writes carry the full shard key, a family's archive stays
+# together and large archives can still split into chunks.
+SHARD_KEY = {"family_id": 1, "_id": 1}
+
+MEMORY_ENTRY_INDEXES = [
+    IndexModel([("family_id", ASCENDING), ("_id", ASCENDING)], name="family_id_1__id_1"),
+    # Lookups by the legacy uuid "id" field
+    IndexModel([("family_id", ASCENDING), ("id", ASCENDING)], name="family_id_1_id_1"),
+    IndexModel([("family_id", ASCENDING), ("date", DESCENDING)], name="family_id_1_date_-1"),
+    IndexModel(
+        [("family_id", ASCENDING), ("category", ASCENDING), ("word_count", ASCENDING)],
+        name="family_id_1_category_1_word_count_1",
+    ),
+]
+
 def get_collection() -> AsyncIOMotorCollection:
     return db.memory_entries
 
+def get_timeline_collection() -> AsyncIOMotorCollection:
+    return db.memory_timeline
+
+async def record_batch_rollups(entries: List[dict]):
+    await timeline.record_entries(get_timeline_collection(), entries)
+
+# Optional group commit for entry creation: concurrent POSTs inside the window
+# share one insert_many (and one rollup write) instead of a round trip each
+entry_batcher: Optional[InsertBatcher] = None
+if os.environ.get("ENTRY_WRITE_BATCHING", "false").lower() == "true":
+    entry_batcher = InsertBatcher(
+        get_collection(),
+        window_ms=float(os.environ.get("ENTRY_BATCH_WINDOW_MS", "2")),
+        max_batch=int(os.environ.get("ENTRY_BATCH_MAX_SIZE", "64")),
+        on_flush=record_batch_rollups
+    )
+
+async def drain_entry_writes():
+    """Flush batched inserts that are still waiting (called on shutdown)"""
+    if entry_batcher is not None:
+        await entry_batcher.drain()
+
+# Entry change events for SSE subscribers, fed by a change stream when the
+# deployment supports one and by the handlers below otherwise
+event_broker = EventBroker(
+    history_size=int(os.environ.get("EVENTS_HISTORY_SIZE", "200")),
+    queue_size=int(os.environ.get("EVENTS_QUEUE_SIZE", "100")),
+    max_families=int(os.environ.get("EVENTS_HISTORY_FAMILIES", "1000"))
+)
+event_feed: Optional[asyncio.Task] = None
+
+def start_event_feed():
+    global event_feed
+    event_feed = asyncio.create_task(feed_from_change_stream(event_broker, get_collection()))
+
+async def stop_event_feed():
+    if event_feed is not None:
+        event_feed.cancel()
+        try:
+            await event_feed
+        except asyncio.CancelledError:
+            pass
+
+async def enable_pre_images():
+    """Record pre-images so change stream deletes carry the deleted entry's family_id (MongoDB 6.0+)"""
+    try:
+        await db.command("collMod", get_collection().name, changeStreamPreAndPostImages={"enabled": True})
+        event_broker.delete_pre_images = True
+    except OperationFailure as e:
+        logger.info(f"Change stream pre-images unavailable, deletes are published in-process: {e}")
+
+async def ensure_indexes():
+    """Create the tenant-scoped compound indexes (idempotent)"""
+    await get_collection().create_indexes(MEMORY_ENTRY_INDEXES)
+    await timeline.ensure_timeline_indexes(get_timeline_collection())
+    await enable_pre_images()
+
+def get_tenant(
+    x_family_id: Optional[str] = Header(default=None),
+    x_user_id: Optional[str] = Header(default=None),
+    family_id: Optional[str] = Query(default=None),
+) -> Tenant:
+    """Resolve the partition a request belongs to from its headers, or the family_id
+    query parameter for clients that cannot set headers (EventSource)"""
+    if x_family_id is None and family_id is None:
+        family_id = DEFAULT_FAMILY_ID
+    family_id = (x_family_id if x_family_id is not None else family_id).strip()
+    if not family_id or len(family_id) > 128:
+        raise HTTPException(status_code=400, detail="Invalid X-Family-Id header or family_id parameter")
+    return Tenant(family_id=family_id, user_id=x_user_id)
+
+async def load_family_entries(family_id: str) -> List[dict]:
+    """Text fields the related-memories index is built from"""
+    cursor = get_collection().find({"family_id": family_id}, {"prompt": 1, "content": 1})
+    return await cursor.to_list(length=None)
+
+# Per-family TF-IDF indexes, built on first use and kept current from the entry
+# events, which include other workers' and nodes' writes once a change stream feeds them
+related_index = RelatedMemoriesRegistry(
+    load_family_entries,
+    max_families=int(os.environ.get("RELATED_INDEX_MAX_FAMILIES", "64"))
+)
+event_broker.add_listener(related_index.apply_event)
+
+def tenant_entry_filter(tenant: Tenant, entry_id: str) -> dict:
+    """Filter for one entry in the tenant's partition: by _id (what the API returns),
+    or by the legacy uuid id field when entry_id is not an ObjectId"""
+    if ObjectId.is_valid(entry_id):
+        return {"family_id": tenant.family_id, "_id": ObjectId(entry_id)}
+    return {"family_id": tenant.family_id, "id": entry_id}
+
+async def find_tenant_entry(collection: AsyncIOMotorCollection, tenant: Tenant, entry_id: str) -> Optional[dict]:
+    """Find an entry within the tenant's partition in a single round trip"""
+    return await collection.find_one(tenant_entry_filter(tenant, entry_id))
+
 @router.get("/prompts", response_model=List[MemoryPrompt])
 async def get_memory_prompts():
     """Get all available memory prompts"""
@@ -71,14 +202,41 @@ async def get_random_prompt():
         logger.error(f"Error fetching random prompt: {e}")
         raise HTTPException(status_code=500, detail="Error fetching random prompt")
 
+@router.get("/prompts/recommended", response_model=List[MemoryPrompt])
+async def get_recommended_prompts(limit: int = Query(default=3, ge=1, le=len(MEMORY_PROMPTS)), tenant: Tenant = Depends(get_tenant)):
+    """Get prompts favoring categories the family hasn't written about yet"""
+    try:
+        collection = get_collection()
+        
+        groups = await collection.aggregate([
+            {"$match": {"family_id": tenant.family_id}},
+            {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+        ]).to_list(length=None)
+        category_counts = {group["_id"]: group["count"] for group in groups}
+        
+        answered_prompts = await collection.distinct("prompt", {
+            "family_id": tenant.family_id,
+            "prompt": {"$in": [prompt["prompt"] for prompt in MEMORY_PROMPTS]}
+        })
+        
+        index = await related_index.get(tenant.family_id) if category_counts else None
+        prompts = recommend_prompts(MEMORY_PROMPTS, category_counts, answered_prompts, index, limit)
+        return [MemoryPrompt(**prompt) for prompt in prompts]
+        
+    except Exception as e:
+        logger.error(f"Error fetching recommended prompts: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching recommended prompts")
+
 @router.post("/entries", response_model=MemoryEntryResponse)
-async def create_memory_entry(entry: MemoryEntryCreate):
+async def create_memory_entry(entry: MemoryEntryCreate, tenant: Tenant = Depends(get_tenant)):
     """Create a new memory entry"""
     try:
         collection = get_collection()
         
         # Create memory entry
         memory_entry = MemoryEntry(
+            family_id=tenant.family_id,
+            user_id=tenant.user_id,
             prompt=entry.prompt,
             content=entry.content,
             category=entry.category,
@@ -90,13 +248,21 @@ async def create_memory_entry(entry: MemoryEntryCreate):
         # Convert to dict for MongoDB
         entry_dict = memory_entry.dict()
         
-        # Insert into database
-        result = await collection.insert_one(entry_dict)
+        # Insert into database, coalesced with concurrent inserts when batching is on
+        if entry_batcher is not None:
+            inserted_id = await entry_batcher.insert(entry_dict)
+        else:
+            result = await collection.insert_one(entry_dict)
+            inserted_id = result.inserted_id
+            if inserted_id:
+                await timeline.record_entries(get_timeline_collection(), [entry_dict])
         
-        if result.inserted_id:
-            # Fetch the created entry
-            created_entry = await collection.find_one({"_id": result.inserted_id})
-            created_entry["id"] = str(created_entry["_id"])
+        if inserted_id:
+            event_broker.publish_local(tenant.family_id, entry_event("created", entry_dict))
+            
+            # The stored document is exactly what was inserted, so no re-read
+            created_entry = dict(entry_dict)
+            created_entry["id"] = str(inserted_id)
             del created_entry["_id"]
             
             return MemoryEntryResponse(**created_entry)
@@ -108,13 +274,13 @@ async def create_memory_entry(entry: MemoryEntryCreate):
         raise HTTPException(status_code=500, detail=f"Error creating memory entry: {str(e)}")
 
 @router.get("/entries", response_model=List[MemoryEntryResponse])
-async def get_memory_entries(skip: int = 0, limit: int = 100):
-    """Get all memory entries"""
+async def get_memory_entries(skip: int = 0, limit: int = 100, tenant: Tenant = Depends(get_tenant)):
+    """Get all memory entries for the tenant"""
     try:
         collection = get_collection()
         
-        # Fetch entries sorted by date (newest first)
-        cursor = collection.find().sort("date", -1).skip(skip).limit(limit)
+        # Fetch entries sorted by date (newest first), served by family_id_1_date_-1
+        cursor = collection.find({"family_id": tenant.family_id}).sort("date", -1).skip(skip).limit(limit)
         entries = await cursor.to_list(length=limit)
         
         # Convert ObjectId to string
@@ -129,18 +295,12 @@ async def get_memory_entries(skip: int = 0, limit: int = 100):
         raise HTTPException(status_code=500, detail="Error fetching memory entries")
 
 @router.get("/entries/{entry_id}", response_model=MemoryEntryResponse)
-async def get_memory_entry(entry_id: str):
+async def get_memory_entry(entry_id: str, tenant: Tenant = Depends(get_tenant)):
     """Get a specific memory entry"""
     try:
         collection = get_collection()
         
-        # Try to find by custom id first, then by ObjectId
-        entry = await collection.find_one({"id": entry_id})
-        if not entry:
-            try:
-                entry = await collection.find_one({"_id": ObjectId(entry_id)})
-            except:
-                pass
+        entry = await find_tenant_entry(collection, tenant, entry_id)
                 
         if not entry:
             raise HTTPException(status_code=404, detail="Memory entry not found")
@@ -157,8 +317,45 @@ async def get_memory_entry(entry_id: str):
         logger.error(f"Error fetching memory entry: {e}")
         raise HTTPException(status_code=500, detail="Error fetching memory entry")
 
+@router.get("/entries/{entry_id}/related", response_model=List[RelatedMemory])
+async def get_related_memories(entry_id: str, limit: int = Query(default=5, ge=1, le=50), tenant: Tenant = Depends(get_tenant)):
+    """Get the past memories most similar to an entry by content and prompt"""
+    try:
+        collection = get_collection()
+        
+        entry = await find_tenant_entry(collection, tenant, entry_id)
+        if not entry:
+            raise HTTPException(status_code=404, detail="Memory entry not found")
+            
+        index = await related_index.get(tenant.family_id)
+        matches = index.related(str(entry["_id"]), limit)
+        if not matches:
+            return []
+            
+        related_entries = await collection.find({
+            "family_id": tenant.family_id,
+            "_id": {"$in": [ObjectId(related_id) for related_id, _ in matches]}
+        }).to_list(length=len(matches))
+        by_id = {str(related["_id"]): related for related in related_entries}
+        
+        results = []
+        for related_id, score in matches:
+            related = by_id.get(related_id)
+            if related is None:
+                continue
+            related["id"] = str(related["_id"])
+            del related["_id"]
+            results.append(RelatedMemory(entry=MemoryEntryResponse(**related), score=score))
+        return results
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching related memories: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching related memories")
+
 @router.put("/entries/{entry_id}", response_model=MemoryEntryResponse)
-async def update_memory_entry(entry_id: str, entry: MemoryEntryCreate):
+async def update_memory_entry(entry_id: str, entry: MemoryEntryCreate, tenant: Tenant = Depends(get_tenant)):
     """Update a memory entry"""
     try:
         collection = get_collection()
@@ -167,28 +364,19 @@ async def update_memory_entry(entry_id: str, entry: MemoryEntryCreate):
         update_data = entry.dict()
         update_data["updated_at"] = datetime.utcnow()
         
-        # Try to update by custom id first, then by ObjectId
-        result = await collection.update_one(
-            {"id": entry_id},
-            {"$set": update_data}
+        # The previous version is kept so the timeline rollups can be moved
+        previous_entry = await collection.find_one_and_update(
+            tenant_entry_filter(tenant, entry_id),
+            {"$set": update_data},
+            return_document=ReturnDocument.BEFORE
         )
-        
-        if result.matched_count == 0:
-            try:
-                result = await collection.update_one(
-                    {"_id": ObjectId(entry_id)},
-                    {"$set": update_data}
-                )
-            except:
-                pass
                 
-        if result.matched_count == 0:
+        if previous_entry is None:
             raise HTTPException(status_code=404, detail="Memory entry not found")
             
-        # Fetch updated entry
-        updated_entry = await collection.find_one({"id": entry_id})
-        if not updated_entry:
-            updated_entry = await collection.find_one({"_id": ObjectId(entry_id)})
+        updated_entry = {**previous_entry, **update_data}
+        await timeline.record_update(get_timeline_collection(), previous_entry, updated_entry)
+        event_broker.publish_local(tenant.family_id, entry_event("updated", updated_entry))
             
         updated_entry["id"] = str(updated_entry.get("_id", updated_entry.get("id")))
         if "_id" in updated_entry:
@@ -203,23 +391,19 @@ async def update_memory_entry(entry_id: str, entry: MemoryEntryCreate):
         raise HTTPException(status_code=500, detail="Error updating memory entry")
 
 @router.delete("/entries/{entry_id}")
-async def delete_memory_entry(entry_id: str):
+async def delete_memory_entry(entry_id: str, tenant: Tenant = Depends(get_tenant)):
     """Delete a memory entry"""
     try:
         collection = get_collection()
         
-        # Try to delete by custom id first, then by ObjectId
-        result = await collection.delete_one({"id": entry_id})
-        
-        if result.deleted_count == 0:
-            try:
-                result = await collection.delete_one({"_id": ObjectId(entry_id)})
-            except:
-                pass
+        deleted_entry = await collection.find_one_and_delete(tenant_entry_filter(tenant, entry_id))
                 
-        if result.deleted_count == 0:
+        if deleted_entry is None:
             raise HTTPException(status_code=404, detail="Memory entry not found")
             
+        await timeline.record_deletion(get_timeline_collection(), deleted_entry)
+        event_broker.publish_local(tenant.family_id, entry_event("deleted", deleted_entry))
+            
         return {"message": "Memory entry deleted successfully"}
         
     except HTTPException:
@@ -228,17 +412,43 @@ async def delete_memory_entry(entry_id: str):
         logger.error(f"Error deleting memory entry: {e}")
         raise HTTPException(status_code=500, detail="Error deleting memory entry")
 
+@router.get("/events")
+async def stream_memory_events(
+    last_event_id: Optional[str] = Header(default=None),
+    tenant: Tenant = Depends(get_tenant),
+):
+    """Stream entry create/update/delete events as Server-Sent Events.
+    
+    EventSource cannot set headers, so browsers pass the family as the
+    family_id query parameter. They send Last-Event-ID on reconnect to resume."""
+    return StreamingResponse(
+        event_broker.stream(tenant.family_id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/stats", response_model=MemoryStats)
-async def get_memory_stats():
-    """Get memory statistics"""
+async def get_memory_stats(tenant: Tenant = Depends(get_tenant)):
+    """Get memory statistics for the tenant"""
     try:
         collection = get_collection()
         
-        # Get total count
-        total_entries = await collection.count_documents({})
+        # Group within the tenant's partition; covered by family_id_1_category_1_word_count_1
+        pipeline = [
+            {"$match": {"family_id": tenant.family_id}},
+            {"$group": {
+                "_id": {"$ifNull": ["$category", "Unknown"]},
+                "count": {"$sum": 1},
+                "words": {"$sum": {"$ifNull": ["$word_count", 0]}},
+            }},
+        ]
+        groups = await collection.aggregate(pipeline).to_list(length=None)
+        
+        total_entries = sum(group["count"] for group in groups)
         
         if total_entries == 0:
             return MemoryStats(
+                family_id=tenant.family_id,
                 total_entries=0,
                 total_words=0,
                 average_words=0,
@@ -246,26 +456,21 @@ async def get_memory_stats():
                 recent_entries=[]
             )
         
-        # Get all entries for stats calculation
-        all_entries = await collection.find().to_list(length=None)
-        
         # Calculate stats
-        total_words = sum(entry.get("word_count", 0) for entry in all_entries)
+        total_words = sum(group["words"] for group in groups)
         average_words = total_words // total_entries if total_entries > 0 else 0
         
         # Category counts
-        categories = {}
-        for entry in all_entries:
-            category = entry.get("category", "Unknown")
-            categories[category] = categories.get(category, 0) + 1
+        categories = {group["_id"]: group["count"] for group in groups}
         
         # Recent entries (last 5)
-        recent_entries = await collection.find().sort("date", -1).limit(5).to_list(length=5)
+        recent_entries = await collection.find({"family_id": tenant.family_id}).sort("date", -1).limit(5).to_list(length=5)
         for entry in recent_entries:
             entry["id"] = str(entry["_id"])
             del entry["_id"]
         
         return MemoryStats(
+            family_id=tenant.family_id,
             total_entries=total_entries,
             total_words=total_words,
             average_words=average_words,
@@ -275,4 +480,31 @@ async def get_memory_stats():
         
     except Exception as e:
         logger.error(f"Error fetching memory stats: {e}")
-        raise HTTPException(status_code=500, detail="Error fetching memory stats")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Error fetching memory stats")
+
+@router.get("/stats/timeline", response_model=MemoryTimeline)
+async def get_memory_timeline(
+    granularity: TimelineGranularity = TimelineGranularity.month,
+    from_date: Optional[datetime] = Query(default=None, alias="from"),
+    to_date: Optional[datetime] = Query(default=None, alias="to"),
+    tenant: Tenant = Depends(get_tenant),
+):
+    """Get entries and words per day/week/month and category from the pre-aggregated rollups"""
+    # Compare and query in the stored form, whether or not the client sent an offset
+    from_date = timeline.naive_utc(from_date) if from_date else None
+    to_date = timeline.naive_utc(to_date) if to_date else None
+    if from_date and to_date and from_date >= to_date:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+    try:
+        buckets = await timeline.get_timeline(
+            get_timeline_collection(),
+            tenant.family_id,
+            granularity,
+            from_date,
+            to_date
+        )
+        return MemoryTimeline(family_id=tenant.family_id, granularity=granularity, buckets=buckets)
+        
+    except Exception as e:
+        logger.error(f"Error fetching memory timeline: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching memory timeline")
\ No newline at end of file
@@ -8,6 +8,7 @@ from pathlib import Path
 
 # Import routes
 from routes.memory import router as memory_router
+from routes.memory import ensure_indexes, drain_entry_writes, start_event_feed, stop_event_feed
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -56,8 +57,12 @@ logger = logging.getLogger(__name__)
 @app.on_event("startup")
 async def startup_event():
     logger.info("Memory Keeper API starting up...")
+    await ensure_indexes()
+    start_event_feed()
     
 @app.on_event("shutdown")
 async def shutdown_db_client():
     logger.info("Memory Keeper API shutting down...")
+    await stop_event_feed()
+    await drain_entry_writes()
     client.close()
\ No newline at end of file
@@ -0,0 +1,239 @@
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Set, Tuple
+import asyncio
+import itertools
+import logging
+import uuid
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import OperationFailure, PyMongoError
+
+from models.memory import MemoryEntryResponse, MemoryEvent
+
+logger = logging.getLogger(__name__)
+
+class Subscription:
+    """One SSE client: a bounded queue plus a flag set when it fell behind"""
+
+    def __init__(self, family_id: str, queue_size: int):
+        self.family_id = family_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.lagging = False
+
+class EventBroker:
+    """
+    Fan-out of entry change events to per-family subscribers.
+
+    Events are fed either by a MongoDB change stream (ids are resume tokens,
+    so every node sees every write) or, on standalone servers, published
+    in-process by the route handlers (ids are a local sequence prefixed with
+    a per-boot token, so ids from another process or boot never match). A change
+    stream can only route a delete to its family through the pre-image, so
+    unless `delete_pre_images` is set deletes stay published in-process. The
+    last `history_size` events of each family are kept, so a busy family never
+    pushes a quiet one out of its resume window, for up to `max_families`
+    recently active families. A reconnecting client resumes after its
+    Last-Event-ID. Publishing never blocks: a subscriber whose queue is
+    full is marked lagging and catches up from that history once it has
+    drained, or is told to resync if it fell out of the history entirely.
+    """
+
+    def __init__(self, history_size: int = 200, queue_size: int = 100, max_families: int = 1000):
+        self.queue_size = queue_size
+        self.history_size = history_size
+        self.max_families = max_families
+        # family -> its recent (seq, id, family, event), least recently active family first
+        self.history: "OrderedDict[str, Deque[Tuple[int, str, str, MemoryEvent]]]" = OrderedDict()
+        # Highest sequence no longer retained, per family and for families evicted entirely
+        self.dropped_seq: Dict[str, int] = {}
+        self.evicted_seq = 0
+        self.last_seq = 0
+        self.subscribers: Dict[str, Set[Subscription]] = {}
+        self.listeners: List[Callable[[str, MemoryEvent], None]] = []
+        self.change_stream_active = False
+        self.delete_pre_images = False
+        self.boot_id = uuid.uuid4().hex
+        self._seq = itertools.count(1)
+
+    def subscribe(self, family_id: str) -> Subscription:
+        subscription = Subscription(family_id, self.queue_size)
+        self.subscribers.setdefault(family_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        family = self.subscribers.get(subscription.family_id)
+        if family is not None:
+            family.discard(subscription)
+            if not family:
+                del self.subscribers[subscription.family_id]
+
+    def add_listener(self, listener: Callable[[str, MemoryEvent], None]):
+        """Call `listener(family_id, event)` for every event, e.g. to keep caches current"""
+        self.listeners.append(listener)
+
+    def publish(self, family_id: str, event: MemoryEvent, event_id: Optional[str] = None):
+        for listener in self.listeners:
+            try:
+                listener(family_id, event)
+            except Exception as e:
+                logger.error(f"Error in entry event listener: {e}")
+        seq = self.last_seq = next(self._seq)
+        item = (seq, event_id or f"{self.boot_id}-{seq}", family_id, event)
+        self._remember(family_id, item)
+        for subscription in self.subscribers.get(family_id, ()):
+            if subscription.lagging:
+                continue
+            try:
+                subscription.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                subscription.lagging = True
+
+    def publish_local(self, family_id: str, event: MemoryEvent):
+        """Route-handler hook; ignored while a change stream is feeding the broker, except
+        for deletes the change stream cannot attribute to a family"""
+        if not self.change_stream_active or (event.type == "deleted" and not self.delete_pre_images):
+            self.publish(family_id, event)
+
+    def _remember(self, family_id: str, item: tuple):
+        history = self.history.get(family_id)
+        if history is None:
+            history = self.history[family_id] = deque(maxlen=self.history_size)
+        elif len(history) == history.maxlen:
+            self.dropped_seq[family_id] = history[0][0]
+        history.append(item)
+        self.history.move_to_end(family_id)
+        while len(self.history) > self.max_families:
+            evicted, events = self.history.popitem(last=False)
+            self.dropped_seq.pop(evicted, None)
+            self.evicted_seq = max(self.evicted_seq, events[-1][0])
+
+    def replay(self, family_id: str, after_id: Optional[str] = None, after_seq: Optional[int] = None) -> Optional[List[tuple]]:
+        """Events for a family after an event id or sequence; None if that point is no longer retained"""
+        history = self.history.get(family_id, ())
+        if after_id is not None:
+            if "-" in after_id and not after_id.startswith(f"{self.boot_id}-"):
+                return None  # Issued by another process or before a restart
+            after_seq = next((seq for seq, event_id, _, _ in history if event_id == after_id), None)
+            if after_seq is None:
+                return None
+        elif family_id in self.history:
+            if after_seq < self.dropped_seq.get(family_id, 0):
+                return None
+        elif after_seq < self.evicted_seq:
+            return None  # The family's events may have been evicted with it
+        return [item for item in history if item[0] > after_seq]
+
+    async def stream(self, family_id: str, last_event_id: Optional[str] = None, heartbeat: float = 15) -> AsyncIterator[str]:
+        """Server-Sent Events wire format for one subscriber"""
+        subscription = self.subscribe(family_id)
+        last_seq = self.last_seq
+        try:
+            yield "retry: 3000\n\n"
+            if last_event_id:
+                missed = self.replay(family_id, after_id=last_event_id)
+                if missed is None:
+                    yield "event: resync\ndata: {}\n\n"
+                else:
+                    for item in missed:
+                        last_seq = item[0]
+                        yield self._format(item)
+
+            while True:
+                if subscription.lagging and subscription.queue.empty():
+                    subscription.lagging = False
+                    missed = self.replay(family_id, after_seq=last_seq)
+                    if missed is None:
+                        yield "event: resync\ndata: {}\n\n"
+                        last_seq = self.last_seq
+                    else:
+                        for item in missed:
+                            last_seq = item[0]
+                            yield self._format(item)
+                    continue
+
+                try:
+                    item = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if item[0] <= last_seq:
+                    continue  # Already delivered by a replay
+                last_seq = item[0]
+                yield self._format(item)
+        finally:
+            self.unsubscribe(subscription)
+
+    @staticmethod
+    def _format(item: tuple) -> str:
+        _, event_id, _, event = item
+        return f"id: {event_id}\nevent: {event.type}\ndata: {event.json(exclude={'entry': {'audio_data'}})}\n\n"
+
+def entry_event(event_type: str, entry: dict) -> MemoryEvent:
+    """Build an event from a stored entry document"""
+    entry_id = str(entry.get("_id", entry.get("id")))
+    if event_type == "deleted":
+        return MemoryEvent(type=event_type, entry_id=entry_id)
+    fields = {key: value for key, value in entry.items() if key != "_id"}
+    fields["id"] = entry_id
+    return MemoryEvent(type=event_type, entry_id=entry_id, entry=MemoryEntryResponse(**fields))
+
+CHANGE_TYPES = {"insert": "created", "replace": "updated", "update": "updated", "delete": "deleted"}
+CHANGE_PIPELINE = [{"$match": {"operationType": {"$in": list(CHANGE_TYPES)}}}]
+CHANGE_STREAM_HISTORY_LOST = 286
+UNKNOWN_FIELD = 40415  # Servers before 6.0 reject fullDocumentBeforeChange as an unknown $changeStream field
+
+def _pre_images_unsupported(error: OperationFailure) -> bool:
+    return error.code == UNKNOWN_FIELD and "fullDocumentBeforeChange" in str(error)
+
+def _publish_change(broker: EventBroker, change: dict):
+    event_type = CHANGE_TYPES[change["operationType"]]
+    if event_type == "deleted":
+        if not broker.delete_pre_images:
+            return  # Published in-process by the handler that deleted it
+        # documentKey carries family_id only when sharded on it, so prefer the pre-image
+        entry = change["documentKey"]
+        family_id = (change.get("fullDocumentBeforeChange") or {}).get("family_id") or entry.get("family_id")
+    else:
+        entry = change.get("fullDocument")
+        if entry is None:
+            return  # Deleted before the update lookup ran
+        family_id = entry.get("family_id")
+    if family_id is None:
+        logger.debug(f"Skipping change without family_id: {change.get('documentKey')}")
+        return
+    broker.publish(family_id, entry_event(event_type, entry), event_id=change["_id"]["_data"])
+
+async def feed_from_change_stream(broker: EventBroker, collection: AsyncIOMotorCollection, retry_seconds: float = 30):
+    """Publish change stream events into the broker; on standalone servers stay in local mode and retry"""
+    resume_token = None
+    pre_images = True
+    while True:
+        options = {"full_document": "updateLookup", "resume_after": resume_token}
+        if pre_images:
+            options["full_document_before_change"] = "whenAvailable"
+        else:
+            # Without pre-images deletes cannot be routed here, so handlers keep publishing them
+            broker.delete_pre_images = False
+        try:
+            async with collection.watch(CHANGE_PIPELINE, **options) as stream:
+                broker.change_stream_active = True
+                logger.info("Entry events fed by MongoDB change stream")
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    _publish_change(broker, change)
+        except asyncio.CancelledError:
+            broker.change_stream_active = False
+            raise
+        except OperationFailure as e:
+            if pre_images and _pre_images_unsupported(e):
+                logger.info("Change stream pre-images need MongoDB 6.0+; deletes stay published in-process")
+                pre_images = False
+                continue
+            if e.code == CHANGE_STREAM_HISTORY_LOST:
+                resume_token = None
+            logger.info(f"Change streams unavailable, using in-process events: {e}")
+            broker.change_stream_active = False
+        except PyMongoError as e:
+            logger.warning(f"Change stream interrupted, using in-process events: {e}")
+            broker.change_stream_active = False
+        await asyncio.sleep(retry_seconds)
@@ -0,0 +1,399 @@
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import asyncio
+import logging
+import math
+import re
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+STOP_WORDS = frozenset("""
+a about after again all also am an and any are as at be because been before being but by
+can could did do does doing don't down during each few for from had has have having he her
+here hers him his how i i'm if in into is it it's its just like me more most my no nor not
+now of off on once only or other our ours out over own really same she so some such than
+that the their theirs them then there these they this those through to too under until up
+us very was we were what when where which while who whom why will with would you your
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_RE.findall(text.lower()) if len(token) > 1 and token not in STOP_WORDS]
+
+def entry_text(entry: dict) -> str:
+    """The text an entry is matched on: the prompt it answered plus what was written"""
+    return f"{entry.get('prompt', '')} {entry.get('content', '')}"
+
+class RelatedMemoriesIndex:
+    """
+    TF-IDF index over one family's memories with batched cosine similarity.
+
+    Compacted rows live in a term -> postings (CSC) matrix of unit-length
+    TF-IDF weights, so a query only touches the postings of its own terms.
+    Writes append to a small delta segment and deleted or edited rows are
+    masked out; once pending changes pass `compact_ratio` of the live rows
+    `needs_compaction` is set. Compaction is split so the expensive part,
+    `build_postings`, can run off the event loop between a cheap
+    `compaction_snapshot` and `install`.
+    """
+
+    def __init__(self, compact_ratio: float = 0.1, min_compact: int = 256):
+        self.compact_ratio = compact_ratio
+        self.min_compact = min_compact
+        self._reset()
+
+    def _reset(self):
+        self.vocabulary: Dict[str, int] = {}
+        self.doc_freq = np.zeros(0, dtype=np.int32)
+
+        # Row storage (sorted term ids + sublinear TF), append-only between compactions
+        self.row_ids: List[str] = []
+        self.row_of: Dict[str, int] = {}
+        self.row_terms: List[np.ndarray] = []
+        self.row_tf: List[np.ndarray] = []
+        self.alive = np.zeros(0, dtype=bool)
+
+        # Compacted postings plus the IDF snapshot they were weighted with
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.post_rows = np.zeros(0, dtype=np.int32)
+        self.post_weights = np.zeros(0, dtype=np.float32)
+        self.compacted_rows = 0
+
+        # Rows appended since the last compaction: (row, terms, unit weights)
+        self.delta: List[Tuple[int, np.ndarray, np.ndarray]] = []
+        self._delta_arrays: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return len(self.row_of)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the index's arrays"""
+        arrays = [self.doc_freq, self.alive, self.idf, self.indptr, self.post_rows, self.post_weights]
+        arrays += self.row_terms + self.row_tf + [array for _, terms, weights in self.delta for array in (terms, weights)]
+        return sum(array.nbytes for array in arrays)
+
+    def _idf_for(self, terms: np.ndarray) -> np.ndarray:
+        """IDF snapshot for known terms; terms first seen since the last compaction count as rare"""
+        weights = np.full(len(terms), math.log((1 + max(len(self), 1)) / 2) + 1, dtype=np.float32)
+        known = terms < len(self.idf)
+        weights[known] = self.idf[terms[known]]
+        return weights
+
+    def _term_frequencies(self, text: str, grow: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """Sorted term ids with sublinear (1 + log) term frequencies"""
+        counts: Dict[int, int] = {}
+        for token in tokenize(text):
+            term = self.vocabulary.get(token)
+            if term is None:
+                if not grow:
+                    continue
+                term = self.vocabulary[token] = len(self.vocabulary)
+            counts[term] = counts.get(term, 0) + 1
+
+        terms = np.array(sorted(counts), dtype=np.int32)
+        tf = 1 + np.log(np.array([counts[term] for term in terms], dtype=np.float32))
+        return terms, tf.astype(np.float32)
+
+    def _weigh(self, terms: np.ndarray, tf: np.ndarray) -> np.ndarray:
+        weights = tf * self._idf_for(terms)
+        norm = np.linalg.norm(weights)
+        return weights / norm if norm > 0 else weights
+
+    def vectorize(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Unit-length TF-IDF query vector; words the archive has never used are ignored"""
+        terms, tf = self._term_frequencies(text, grow=False)
+        return terms, self._weigh(terms, tf)
+
+    def _append_row(self, entry_id: str, terms: np.ndarray, tf: np.ndarray) -> int:
+        if len(self.vocabulary) > len(self.doc_freq):
+            grown = np.zeros(max(len(self.vocabulary), 2 * len(self.doc_freq)), dtype=np.int32)
+            grown[:len(self.doc_freq)] = self.doc_freq
+            self.doc_freq = grown
+        self.doc_freq[terms] += 1
+
+        row = len(self.row_ids)
+        if row >= len(self.alive):
+            grown = np.zeros(max(64, 2 * len(self.alive)), dtype=bool)
+            grown[:len(self.alive)] = self.alive
+            self.alive = grown
+        self.alive[row] = True
+        self.row_ids.append(entry_id)
+        self.row_terms.append(terms)
+        self.row_tf.append(tf)
+        self.row_of[entry_id] = row
+        return row
+
+    def _drop_row(self, entry_id: str) -> bool:
+        row = self.row_of.pop(entry_id, None)
+        if row is None:
+            return False
+        self.alive[row] = False
+        self.doc_freq[self.row_terms[row]] -= 1
+        return True
+
+    def build(self, entries: Iterable[dict]):
+        """Index a full archive from scratch"""
+        self._reset()
+        for entry in entries:
+            terms, tf = self._term_frequencies(entry_text(entry), grow=True)
+            self._append_row(str(entry["_id"]), terms, tf)
+        self.compact()
+
+    def upsert(self, entry: dict):
+        """Add a new entry, or replace an edited one"""
+        entry_id = str(entry["_id"])
+        self._drop_row(entry_id)
+        terms, tf = self._term_frequencies(entry_text(entry), grow=True)
+        row = self._append_row(entry_id, terms, tf)
+        self.delta.append((row, terms, self._weigh(terms, tf)))
+        self._delta_arrays = None
+
+    def remove(self, entry_id: str):
+        self._drop_row(entry_id)
+
+    @property
+    def needs_compaction(self) -> bool:
+        dead = self.compacted_rows - int(self.alive[:self.compacted_rows].sum())
+        return len(self.delta) + dead > max(self.min_compact, self.compact_ratio * len(self))
+
+    def compact(self):
+        """Drop dead rows, refresh the IDF snapshot and rebuild the postings, all in the calling thread"""
+        snapshot = self.compaction_snapshot()
+        self.install(snapshot, self.build_postings(*snapshot[2:]))
+
+    def compaction_snapshot(self) -> tuple:
+        """The live rows and document frequencies compaction reads (cheap, taken on the event loop)"""
+        live = np.flatnonzero(self.alive[:len(self.row_ids)])
+        return (
+            len(self.row_ids),
+            live,
+            [self.row_terms[row] for row in live],
+            [self.row_tf[row] for row in live],
+            self.doc_freq[:len(self.vocabulary)].copy(),
+        )
+
+    @staticmethod
+    def build_postings(row_terms: List[np.ndarray], row_tf: List[np.ndarray], doc_freq: np.ndarray) -> tuple:
+        """IDF and unit-length postings for a snapshot; touches no shared state, so safe off the loop"""
+        n, n_terms = len(row_terms), len(doc_freq)
+        idf = (np.log((1 + n) / (1 + doc_freq.astype(np.float32))) + 1).astype(np.float32)
+
+        lengths = np.array([len(terms) for terms in row_terms], dtype=np.int64)
+        terms = np.concatenate(row_terms) if n else np.zeros(0, dtype=np.int32)
+        rows = np.repeat(np.arange(n, dtype=np.int32), lengths)
+        weights = np.concatenate(row_tf) * idf[terms] if n else np.zeros(0, dtype=np.float32)
+        norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=n)).astype(np.float32)
+        weights = weights / np.where(norms > 0, norms, 1)[rows]
+
+        order = np.argsort(terms, kind="stable")
+        indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=n_terms), out=indptr[1:])
+        return idf, indptr, rows[order], weights[order].astype(np.float32)
+
+    def install(self, snapshot: tuple, postings: tuple):
+        """Swap in postings built from `snapshot`; writes made since become the new delta"""
+        snapshot_rows, live, live_terms, live_tf, _ = snapshot
+        later = [row for row in range(snapshot_rows, len(self.row_ids)) if self.alive[row]]
+
+        self.row_ids = [self.row_ids[row] for row in live] + [self.row_ids[row] for row in later]
+        self.row_terms = live_terms + [self.row_terms[row] for row in later]
+        self.row_tf = live_tf + [self.row_tf[row] for row in later]
+        # Rows dropped since the snapshot stay masked at their new position
+        self.alive = np.concatenate([self.alive[live], np.ones(len(later), dtype=bool)])
+        self.row_of = {self.row_ids[row]: row for row in np.flatnonzero(self.alive)}
+
+        self.idf, self.indptr, self.post_rows, self.post_weights = postings
+        self.compacted_rows = len(live)
+        self.delta = [
+            (row, self.row_terms[row], self._weigh(self.row_terms[row], self.row_tf[row]))
+            for row in range(len(live), len(self.row_ids))
+        ]
+        self._delta_arrays = None
+
+    def _delta_segment(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self._delta_arrays is None:
+            if self.delta:
+                rows = np.concatenate([np.full(len(terms), row, dtype=np.int32) for row, terms, _ in self.delta])
+                terms = np.concatenate([terms for _, terms, _ in self.delta])
+                weights = np.concatenate([weights for _, _, weights in self.delta])
+            else:
+                rows = terms = np.zeros(0, dtype=np.int32)
+                weights = np.zeros(0, dtype=np.float32)
+            self._delta_arrays = (rows, terms, weights)
+        return self._delta_arrays
+
+    def scores(self, queries: Sequence[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+        """Cosine similarity of a batch of query vectors against every row, shape (batch, rows)"""
+        batch, n_rows = len(queries), len(self.row_ids)
+        query_rows = np.concatenate([np.full(len(terms), i, dtype=np.int64) for i, (terms, _) in enumerate(queries)])
+        query_terms = np.concatenate([terms for terms, _ in queries]).astype(np.int64)
+        query_weights = np.concatenate([weights for _, weights in queries]).astype(np.float32)
+
+        # Compacted segment: gather the postings of every (query, term) pair
+        compacted = query_terms < len(self.indptr) - 1
+        starts = self.indptr[query_terms[compacted]]
+        lengths = self.indptr[query_terms[compacted] + 1] - starts
+        total = int(lengths.sum())
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        flat_rows = np.repeat(query_rows[compacted], lengths) * n_rows + self.post_rows[offsets]
+        flat_weights = np.repeat(query_weights[compacted], lengths) * self.post_weights[offsets]
+
+        # Delta segment: dense per-query term weights against the few recent rows
+        delta_rows, delta_terms, delta_weights = self._delta_segment()
+        if len(delta_rows):
+            dense = np.zeros((batch, len(self.vocabulary)), dtype=np.float32)
+            dense[query_rows, query_terms] = query_weights
+            contributions = dense[:, delta_terms] * delta_weights
+            flat_rows = np.concatenate([flat_rows, (np.arange(batch)[:, None] * n_rows + delta_rows).ravel()])
+            flat_weights = np.concatenate([flat_weights, contributions.ravel()])
+
+        scores = np.bincount(flat_rows, weights=flat_weights, minlength=batch * n_rows).reshape(batch, n_rows)
+        scores[:, ~self.alive[:n_rows]] = 0
+        return scores
+
+    def top_k(self, scores: np.ndarray, k: int, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Best k (entry id, score) pairs from one row of `scores`, skipping `exclude`"""
+        scores = scores.copy()
+        if exclude in self.row_of:
+            scores[self.row_of[exclude]] = 0
+        k = min(k, int(np.count_nonzero(scores > 0)))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(self.row_ids[row], float(scores[row])) for row in best]
+
+    def related(self, entry_id: str, k: int = 5) -> List[Tuple[str, float]]:
+        """Entries most similar to an indexed entry, by content and prompt"""
+        row = self.row_of.get(entry_id)
+        if row is None:
+            return []
+        terms, tf = self.row_terms[row], self.row_tf[row]
+        return self.top_k(self.scores([(terms, self._weigh(terms, tf))])[0], k, exclude=entry_id)
+
+class RelatedMemoriesRegistry:
+    """
+    Lazily built per-family indexes, least recently used families evicted first.
+
+    Writes that arrive while a family's index is being loaded and built are
+    buffered and replayed onto it before it is registered, so none are lost
+    between the loader's read and the index going live. Compaction runs in a
+    background task with the postings rebuilt in an executor, so writes
+    never block the event loop on it.
+
+    Indexes only see the writes fed to them. Feed them from the entry event
+    broker (`apply_event`): with a change stream that covers writes from
+    every worker and node; without one, only this process's own writes.
+    """
+
+    def __init__(self, loader: Callable[[str], Awaitable[List[dict]]], max_families: int = 64):
+        self.loader = loader
+        self.max_families = max_families
+        self.indexes: "OrderedDict[str, RelatedMemoriesIndex]" = OrderedDict()
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.building: Dict[str, List[Tuple[str, object]]] = {}  # family -> buffered ("upsert" | "remove", payload)
+        self.compactions: Dict[str, asyncio.Task] = {}
+
+    async def get(self, family_id: str) -> RelatedMemoriesIndex:
+        index = self.indexes.get(family_id)
+        if index is None:
+            lock = self.locks.setdefault(family_id, asyncio.Lock())
+            async with lock:
+                index = self.indexes.get(family_id)
+                if index is None:
+                    self.building[family_id] = []
+                    try:
+                        entries = await self.loader(family_id)
+                        index = RelatedMemoriesIndex()
+                        await asyncio.get_running_loop().run_in_executor(None, index.build, entries)
+                    finally:
+                        buffered = self.building.pop(family_id)
+                    for operation, payload in buffered:
+                        if operation == "upsert":
+                            index.upsert(payload)
+                        else:
+                            index.remove(payload)
+                    self._schedule_compaction(family_id, index)
+                    logger.info(
+                        f"Built related-memories index for family {family_id!r}: "
+                        f"{len(index)} entries, {len(index.vocabulary)} terms, {index.nbytes / 2**20:.1f} MiB"
+                    )
+                    self.indexes[family_id] = index
+                    while len(self.indexes) > self.max_families:
+                        evicted, _ = self.indexes.popitem(last=False)
+                        self.locks.pop(evicted, None)
+        self.indexes.move_to_end(family_id)
+        return index
+
+    def upsert(self, family_id: str, entry: dict):
+        """Apply a write to a built index, or buffer it while one is building; unloaded families pick it up when loaded"""
+        if family_id in self.building:
+            self.building[family_id].append(("upsert", entry))
+            return
+        index = self.indexes.get(family_id)
+        if index is not None:
+            index.upsert(entry)
+            self._schedule_compaction(family_id, index)
+
+    def remove(self, family_id: str, entry_id: str):
+        if family_id in self.building:
+            self.building[family_id].append(("remove", entry_id))
+            return
+        index = self.indexes.get(family_id)
+        if index is not None:
+            index.remove(entry_id)
+            self._schedule_compaction(family_id, index)
+
+    def apply_event(self, family_id: str, event):
+        """Entry event broker listener: keep indexes current with created/updated/deleted entries"""
+        if event.type == "deleted":
+            self.remove(family_id, event.entry_id)
+        elif event.entry is not None:
+            self.upsert(family_id, {"_id": event.entry_id, "prompt": event.entry.prompt, "content": event.entry.content})
+
+    def _schedule_compaction(self, family_id: str, index: RelatedMemoriesIndex):
+        if index.needs_compaction and family_id not in self.compactions:
+            task = asyncio.get_running_loop().create_task(self._compact(index))
+            self.compactions[family_id] = task
+            task.add_done_callback(lambda _: self.compactions.pop(family_id, None))
+
+    async def _compact(self, index: RelatedMemoriesIndex):
+        try:
+            snapshot = index.compaction_snapshot()
+            postings = await asyncio.get_running_loop().run_in_executor(None, index.build_postings, *snapshot[2:])
+            index.install(snapshot, postings)
+        except Exception as e:
+            logger.error(f"Error compacting related-memories index: {e}")
+
+def recommend_prompts(
+    prompts: List[dict],
+    category_counts: Dict[str, int],
+    answered_prompts: Iterable[str],
+    index: Optional[RelatedMemoriesIndex] = None,
+    limit: int = 3,
+) -> List[dict]:
+    """
+    Rank prompts so categories the family has written least about come first,
+    then prompts not answered yet, then those closest to what they have written
+    (best cosine match against the archive, scored in one batch).
+    """
+    relevance = np.zeros(len(prompts), dtype=np.float32)
+    if index is not None and len(index):
+        scores = index.scores([index.vectorize(prompt["prompt"]) for prompt in prompts])
+        relevance = scores.max(axis=1)
+
+    answered = set(answered_prompts)
+    ranked = sorted(
+        range(len(prompts)),
+        key=lambda i: (
+            category_counts.get(prompts[i]["category"], 0),
+            prompts[i]["prompt"] in answered,
+            -relevance[i],
+        ),
+    )
+    return [prompts[i] for i in ranked[:limit]]
@@ -0,0 +1,168 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ASCENDING, IndexModel, InsertOne, UpdateOne
+
+from models.memory import DEFAULT_FAMILY_ID, TimelineBucket, TimelineGranularity
+
+logger = logging.getLogger(__name__)
+
+# One rollup document per (family, granularity, bucket, category). Reads for a
+# range touch only the buckets in it, never the raw entries.
+TIMELINE_INDEXES = [
+    IndexModel(
+        [("family_id", ASCENDING), ("granularity", ASCENDING), ("bucket_start", ASCENDING)],
+        name="family_id_1_granularity_1_bucket_start_1",
+    ),
+]
+
+ROLLUP_FIELDS = {"family_id": 1, "date": 1, "category": 1, "word_count": 1}
+
+def naive_utc(date: datetime) -> datetime:
+    """Entries are stored as naive UTC, so compare everything in that form"""
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+def bucket_start(date: datetime, granularity: TimelineGranularity) -> datetime:
+    """Truncate a date to the start of its day, ISO week (Monday) or month"""
+    day = naive_utc(date).replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == TimelineGranularity.week:
+        return day - timedelta(days=day.weekday())
+    if granularity == TimelineGranularity.month:
+        return day.replace(day=1)
+    return day
+
+def _bucket_key(entry: dict, granularity: TimelineGranularity) -> tuple:
+    return (
+        entry.get("family_id", DEFAULT_FAMILY_ID),
+        granularity.value,
+        bucket_start(entry.get("date") or datetime.utcnow(), granularity),
+        entry.get("category", "Unknown"),
+    )
+
+def _bucket_id(key: tuple) -> str:
+    family_id, granularity, start, category = key
+    return f"{family_id}|{granularity}|{start.date().isoformat()}|{category}"
+
+def _accumulate(totals: Dict[tuple, List[int]], entries: Iterable[dict], sign: int = 1):
+    """Add each entry's count and words into every granularity's bucket"""
+    for entry in entries:
+        words = entry.get("word_count", 0) or 0
+        for granularity in TimelineGranularity:
+            bucket = totals.setdefault(_bucket_key(entry, granularity), [0, 0])
+            bucket[0] += sign
+            bucket[1] += sign * words
+
+def _bucket_doc(key: tuple) -> dict:
+    family_id, granularity, start, category = key
+    return {
+        "_id": _bucket_id(key),
+        "family_id": family_id,
+        "granularity": granularity,
+        "bucket_start": start,
+        "category": category,
+    }
+
+async def ensure_timeline_indexes(collection: AsyncIOMotorCollection):
+    await collection.create_indexes(TIMELINE_INDEXES)
+
+async def apply_changes(collection: AsyncIOMotorCollection, added: Iterable[dict] = (), removed: Iterable[dict] = ()):
+    """Fold created/deleted entries into their rollup buckets with one bulk write"""
+    totals: Dict[tuple, List[int]] = {}
+    _accumulate(totals, added, 1)
+    _accumulate(totals, removed, -1)
+
+    operations = []
+    for key, (entries, words) in totals.items():
+        if entries == 0 and words == 0:
+            continue
+        doc = _bucket_doc(key)
+        operations.append(UpdateOne(
+            {"_id": doc.pop("_id"), "family_id": doc["family_id"]},
+            {"$inc": {"entries": entries, "words": words}, "$setOnInsert": doc},
+            upsert=True,
+        ))
+
+    if operations:
+        await collection.bulk_write(operations, ordered=False)
+
+async def record_entries(collection: AsyncIOMotorCollection, entries: List[dict]):
+    """Rollup hook for newly written entries; a failure here never fails the write"""
+    try:
+        await apply_changes(collection, added=entries)
+    except Exception as e:
+        logger.error(f"Error updating timeline rollups (rebuild to repair): {e}")
+
+async def record_update(collection: AsyncIOMotorCollection, before: dict, after: dict):
+    """Move an edited entry between buckets if its category, date or length changed"""
+    if all(before.get(field) == after.get(field) for field in ROLLUP_FIELDS):
+        return
+    try:
+        await apply_changes(collection, added=[after], removed=[before])
+    except Exception as e:
+        logger.error(f"Error updating timeline rollups (rebuild to repair): {e}")
+
+async def record_deletion(collection: AsyncIOMotorCollection, entry: dict):
+    try:
+        await apply_changes(collection, removed=[entry])
+    except Exception as e:
+        logger.error(f"Error updating timeline rollups (rebuild to repair): {e}")
+
+async def rebuild(
+    entries_collection: AsyncIOMotorCollection,
+    collection: AsyncIOMotorCollection,
+    family_id: Optional[str] = None,
+    batch_size: int = 1000,
+) -> int:
+    """Recompute rollups from raw entries (for one family or everyone); returns bucket count"""
+    query = {"family_id": family_id} if family_id else {}
+    totals: Dict[tuple, List[int]] = {}
+    async for entry in entries_collection.find(query, ROLLUP_FIELDS).batch_size(batch_size):
+        _accumulate(totals, [entry])
+
+    await collection.delete_many(query)
+
+    operations = []
+    for key, (entries, words) in totals.items():
+        doc = _bucket_doc(key)
+        doc.update(entries=entries, words=words)
+        operations.append(InsertOne(doc))
+        if len(operations) >= batch_size:
+            await collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await collection.bulk_write(operations, ordered=False)
+
+    return len(totals)
+
+async def get_timeline(
+    collection: AsyncIOMotorCollection,
+    family_id: str,
+    granularity: TimelineGranularity,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> List[TimelineBucket]:
+    """Read the rollup buckets whose start falls in [start, end), merged per bucket"""
+    query = {"family_id": family_id, "granularity": granularity.value, "entries": {"$gt": 0}}
+    bucket_range = {}
+    if start:
+        bucket_range["$gte"] = bucket_start(start, granularity)
+    if end:
+        bucket_range["$lt"] = naive_utc(end)
+    if bucket_range:
+        query["bucket_start"] = bucket_range
+
+    buckets: Dict[datetime, TimelineBucket] = {}
+    cursor = collection.find(query, {"bucket_start": 1, "category": 1, "entries": 1, "words": 1}).sort("bucket_start", 1)
+    async for doc in cursor:
+        bucket = buckets.get(doc["bucket_start"])
+        if bucket is None:
+            bucket = buckets[doc["bucket_start"]] = TimelineBucket(bucket_start=doc["bucket_start"])
+        bucket.entries += doc["entries"]
+        bucket.words += doc["words"]
+        bucket.categories[doc["category"]] = {"entries": doc["entries"], "words": doc["words"]}
+
+    return list(buckets.values())
@@ -0,0 +1,92 @@
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+import asyncio
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import BulkWriteError, WriteConcernError, WriteError
+
+logger = logging.getLogger(__name__)
+
+class InsertBatcher:
+    """
+    Group commit for single-document inserts.
+
+    Concurrent `insert()` calls are collected for up to `window_ms` (or until
+    `max_batch` are waiting) and written with one unordered `insert_many`.
+    Every caller still gets its own inserted id, or its own exception when
+    its document is the one the server rejected.
+    """
+
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        window_ms: float = 2,
+        max_batch: int = 64,
+        on_flush: Optional[Callable[[List[dict]], Awaitable[None]]] = None,
+    ):
+        self.collection = collection
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.on_flush = on_flush
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    async def insert(self, document: dict):
+        """Queue a document for the next batch and wait for its inserted _id"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((document, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush_pending)
+        # Shield so a disconnecting client does not cancel the shared write
+        return await asyncio.shield(future)
+
+    def _flush_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        documents = [document for document, _ in batch]
+        errors = {}
+        try:
+            await self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                errors[error["index"]] = WriteError(error.get("errmsg"), error.get("code"), error)
+            for error in e.details.get("writeConcernErrors", []):
+                concern_error = WriteConcernError(error.get("errmsg"), error.get("code"), error)
+                errors.update({i: concern_error for i in range(len(batch)) if i not in errors})
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        inserted = [document for i, document in enumerate(documents) if i not in errors]
+        if inserted and self.on_flush is not None:
+            try:
+                await self.on_flush(inserted)
+            except Exception as e:
+                logger.error(f"Error in insert batch flush hook: {e}")
+
+        for i, (document, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i in errors:
+                future.set_exception(errors[i])
+            else:
+                future.set_result(document["_id"])
+
+    async def drain(self):
+        """Flush anything still waiting and wait for in-flight batches (used on shutdown)"""
+        self._flush_pending()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
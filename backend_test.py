@@ -10,6 +10,7 @@ import base64
 import os
 from datetime import datetime
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Get backend URL from environment
 BACKEND_URL = "https://e88cb52a-d876-4ae2-9666-095c383db523.preview.emergentagent.com/api"
@@ -157,6 +158,31 @@ class MemoryKeeperAPITester:
             self.log_test("Create Memory (With Audio)", False, f"Error: {str(e)}")
         return None
         
+    def test_concurrent_creates(self, count=20):
+        """Test concurrent POST /api/memory/entries (exercises write batching when enabled)"""
+        def create(i):
+            memory_data = {
+                "prompt": "What songs do you remember from when you were young?",
+                "content": f"Concurrent test memory number {i}",
+                "category": "Music",
+                "word_count": 5
+            }
+            return requests.post(f"{self.base_url}/memory/entries", json=memory_data, timeout=10)
+            
+        try:
+            with ThreadPoolExecutor(max_workers=count) as executor:
+                responses = list(executor.map(create, range(count)))
+            created_ids = [response.json()["id"] for response in responses if response.status_code == 200]
+            self.created_entries.extend(created_ids)
+            if len(set(created_ids)) == count:
+                self.log_test("Concurrent Creates", True, f"Created {count} entries concurrently with distinct IDs")
+                return True
+            else:
+                self.log_test("Concurrent Creates", False, f"Only {len(set(created_ids))}/{count} distinct entries created")
+        except Exception as e:
+            self.log_test("Concurrent Creates", False, f"Error: {str(e)}")
+        return False
+        
     def test_get_all_entries(self):
         """Test GET /api/memory/entries"""
         try:
@@ -250,6 +276,8 @@ class MemoryKeeperAPITester:
             if response.status_code == 200:
                 result = response.json()
                 if "message" in result:
+                    if entry_id in self.created_entries:
+                        self.created_entries.remove(entry_id)
                     self.log_test("Delete Entry", True, f"Deleted entry {entry_id}")
                     return True
                 else:
@@ -262,6 +290,122 @@ class MemoryKeeperAPITester:
             self.log_test("Delete Entry", False, f"Error: {str(e)}")
         return False
         
+    def test_get_memory_timeline(self):
+        """Test GET /api/memory/stats/timeline"""
+        try:
+            response = requests.get(
+                f"{self.base_url}/memory/stats/timeline",
+                params={"granularity": "day", "from": "2000-01-01T00:00:00"},
+                timeout=10
+            )
+            if response.status_code == 200:
+                timeline = response.json()
+                stats = requests.get(f"{self.base_url}/memory/stats", timeout=10).json()
+                total_entries = sum(bucket["entries"] for bucket in timeline["buckets"])
+                if timeline["granularity"] == "day" and total_entries == stats["total_entries"]:
+                    self.log_test("Get Memory Timeline", True, f"{len(timeline['buckets'])} day buckets, {total_entries} entries")
+                    return timeline
+                else:
+                    self.log_test("Get Memory Timeline", False, f"Rollups ({total_entries}) disagree with stats ({stats['total_entries']})")
+            else:
+                self.log_test("Get Memory Timeline", False, f"Status code: {response.status_code}")
+        except Exception as e:
+            self.log_test("Get Memory Timeline", False, f"Error: {str(e)}")
+        return None
+        
+    def test_related_memories(self):
+        """Test GET /api/memory/entries/{id}/related and /api/memory/prompts/recommended"""
+        # A family of its own, so entries from the shared archive cannot outrank the expected match
+        family = {"X-Family-Id": f"test-related-{int(time.time())}"}
+        memories = [
+            ("Tell me about your favorite childhood memory", "My grandmother's garden was full of roses and we picked berries every morning.", "Childhood"),
+            ("What was your wedding day like?", "The flowers were white roses from my grandmother's garden.", "Family"),
+            ("What was your first job?", "I delivered newspapers on a bicycle before school.", "Career"),
+        ]
+        entry_ids = []
+        try:
+            for prompt, content, category in memories:
+                response = requests.post(
+                    f"{self.base_url}/memory/entries",
+                    json={"prompt": prompt, "content": content, "category": category, "word_count": len(content.split())},
+                    headers=family,
+                    timeout=10
+                )
+                if response.status_code != 200:
+                    self.log_test("Related Memories", False, f"Could not create entry: {response.status_code}")
+                    return None
+                entry_ids.append(response.json()["id"])
+            
+            response = requests.get(f"{self.base_url}/memory/entries/{entry_ids[0]}/related", headers=family, timeout=10)
+            if response.status_code != 200:
+                self.log_test("Related Memories", False, f"Status code: {response.status_code}")
+                return None
+            related = response.json()
+            related_ids = [item["entry"]["id"] for item in related]
+            if not related_ids or related_ids[0] != entry_ids[1] or entry_ids[0] in related_ids:
+                self.log_test("Related Memories", False, f"Unexpected related entries: {related_ids}")
+                return None
+            self.log_test("Related Memories", True, f"Top match score: {related[0]['score']:.3f}")
+            
+            response = requests.get(f"{self.base_url}/memory/prompts/recommended", params={"limit": 3}, headers=family, timeout=10)
+            if response.status_code == 200 and len(response.json()) == 3:
+                self.log_test("Recommended Prompts", True, f"Categories: {[p['category'] for p in response.json()]}")
+            else:
+                self.log_test("Recommended Prompts", False, f"Status code: {response.status_code}")
+            return related
+        except Exception as e:
+            self.log_test("Related Memories", False, f"Error: {str(e)}")
+        finally:
+            for entry_id in entry_ids:
+                requests.delete(f"{self.base_url}/memory/entries/{entry_id}", headers=family, timeout=10)
+        return None
+        
+    def test_event_stream(self):
+        """Test GET /api/memory/events delivers created and deleted events"""
+        try:
+            with requests.get(f"{self.base_url}/memory/events", stream=True, timeout=10) as stream:
+                created = self.test_create_memory_text_only()
+                if not created:
+                    self.log_test("Event Stream", False, "Could not create entry to observe")
+                    return False
+                event_type = None
+                for line in stream.iter_lines(decode_unicode=True):
+                    if line.startswith("event: "):
+                        event_type = line[len("event: "):]
+                    elif line.startswith("data: ") and event_type in ("created", "deleted"):
+                        event = json.loads(line[len("data: "):])
+                        if event["entry_id"] != created["id"]:
+                            continue
+                        if event_type == "created":
+                            self.log_test("Event Stream (Created)", True, f"Received created event for {created['id']}")
+                            self.test_delete_entry(created["id"])
+                        else:
+                            self.log_test("Event Stream (Deleted)", True, f"Received deleted event for {created['id']}")
+                            return True
+        except Exception as e:
+            self.log_test("Event Stream", False, f"Error: {str(e)}")
+            return False
+        self.log_test("Event Stream", False, "Stream ended without the created and deleted events")
+        return False
+        
+    def test_tenant_isolation(self, entry_id):
+        """Test that entries are scoped to the family in X-Family-Id"""
+        try:
+            other_family = {"X-Family-Id": f"test-family-{int(time.time())}"}
+            response = requests.get(f"{self.base_url}/memory/entries/{entry_id}", headers=other_family, timeout=10)
+            if response.status_code != 404:
+                self.log_test("Tenant Isolation", False, f"Expected 404 from another family, got {response.status_code}")
+                return False
+            response = requests.get(f"{self.base_url}/memory/stats", headers=other_family, timeout=10)
+            if response.status_code == 200 and response.json()["total_entries"] == 0:
+                self.log_test("Tenant Isolation", True, "Other family cannot see the entry or count it in stats")
+                return True
+            else:
+                self.log_test("Tenant Isolation", False, f"Unexpected stats for other family: {response.text}")
+        except Exception as e:
+            self.log_test("Tenant Isolation", False, f"Error: {str(e)}")
+        return False
+        
     def test_error_scenarios(self):
         """Test various error scenarios"""
         print("\n=== Testing Error Scenarios ===")
@@ -323,6 +467,7 @@ class MemoryKeeperAPITester:
         # Create entries
         text_entry = self.test_create_memory_text_only()
         audio_entry = self.test_create_memory_with_audio()
+        self.test_concurrent_creates()
         
         # Read operations
         self.test_get_all_entries()
@@ -334,6 +479,17 @@ class MemoryKeeperAPITester:
                 
         # Stats
         self.test_get_memory_stats()
+        self.test_get_memory_timeline()
+        
+        # Related memories
+        self.test_related_memories()
+            
+        # Change feed
+        self.test_event_stream()
+        
+        # Multi-tenant partitioning
+        if text_entry:
+            self.test_tenant_isolation(text_entry["id"])
         
         # Error scenarios
         self.test_error_scenarios()
@@ -343,6 +499,7 @@ class MemoryKeeperAPITester:
             self.test_delete_entry(text_entry["id"])
         if audio_entry:
             self.test_delete_entry(audio_entry["id"])
+        self.cleanup_test_entries()
             
         return self.get_summary()
         
@@ -2,6 +2,8 @@ import axios from 'axios';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API_BASE = `${BACKEND_URL}/api`;
+// Partition key for multi-tenant storage; the backend falls back to "default"
+const FAMILY_ID = process.env.REACT_APP_FAMILY_ID;
 
 // Create axios instance with default config
 const api = axios.create({
@@ -9,6 +11,7 @@ const api = axios.create({
   timeout: 30000, // 30 seconds timeout for large audio files
   headers: {
     'Content-Type': 'application/json',
+    ...(FAMILY_ID ? { 'X-Family-Id': FAMILY_ID } : {}),
   },
 });
 
@@ -129,6 +132,27 @@ export const memoryApi = {
   }
 };
 
+// Subscribe to entry created/updated/deleted events (Server-Sent Events).
+// The browser reconnects on its own and resumes from the last event id;
+// a "resync" event means events were missed and entries should be refetched.
+export const subscribeToEvents = (onEvent, onResync) => {
+  const params = FAMILY_ID ? `?family_id=${encodeURIComponent(FAMILY_ID)}` : '';
+  const source = new EventSource(`${API_BASE}/memory/events${params}`);
+
+  ['created', 'updated', 'deleted'].forEach((type) => {
+    source.addEventListener(type, (event) => {
+      try {
+        onEvent(JSON.parse(event.data));
+      } catch (error) {
+        console.error('Error parsing memory event:', error);
+      }
+    });
+  });
+  source.addEventListener('resync', () => onResync && onResync());
+
+  return () => source.close();
+};
+
 // Utility function to convert blob to base64
 export const blobToBase64 = (blob) => {
   return new Promise((resolve, reject) => {